@@ -1,21 +1,48 @@
 # Requires: python-multipart package for file uploads
-# Install: pip install fastapi uvicorn python-multipart
+# Install: pip install fastapi uvicorn python-multipart httpx uvloop httptools
 
-from fastapi import FastAPI, Request, UploadFile
-from fastapi.responses import StreamingResponse, JSONResponse, HTMLResponse
+from fastapi import FastAPI, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import time
 import os
-import requests
+import sys
+import httpx
 import socket
 import ipaddress
 from typing import Dict, Any
+from collections import OrderedDict
 import asyncio
+import functools
+import tempfile
+import shutil
+from contextlib import asynccontextmanager
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create per-run resources on app.state before serving; release them on shutdown."""
+    # Shared HTTP client so geolocation lookups reuse pooled keep-alive connections
+    app.state.http = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=2.0,
+    )
+    # One max-size payload in a private directory; each download sends its first
+    # size_mb MiB, read back from the page cache
+    app.state.payload_dir = tempfile.mkdtemp(prefix="speedtest_payload_")
+    app.state.payload_path = os.path.join(app.state.payload_dir, "payload.bin")
+    try:
+        await run_in_threadpool(_write_payload_file, app.state.payload_path, DOWNLOAD_MAX_SIZE_MB)
+        yield
+    finally:
+        await app.state.http.aclose()
+        shutil.rmtree(app.state.payload_dir, ignore_errors=True)
 
 app = FastAPI(
     title="Internet Speed Test API",
     version="4.0.0",
-    description="API for testing client network speeds"
+    description="API for testing client network speeds",
+    lifespan=lifespan
 )
 
 # Enable CORS for browser clients
@@ -27,38 +54,154 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Geolocation per IP is stable, so cache ip-api responses in memory (LRU + TTL)
+GEO_CACHE_TTL = 3600
+GEO_CACHE_MAXSIZE = 4096
+_GEO_CACHE: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+# Lookups in progress, so concurrent cache misses for one IP share a single request
+_GEO_INFLIGHT: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+
+async def _fetch_geo(http: httpx.AsyncClient, ip: str) -> Dict[str, Any]:
+    """Fetch geolocation data for an IP from ip-api."""
+    response = await http.get(f"http://ip-api.com/json/{ip}")
+    response.raise_for_status()
+    return response.json()
+
+async def geo_lookup(http: httpx.AsyncClient, ip: str) -> Dict[str, Any]:
+    """Get ip-api geolocation data for an IP, served from cache when fresh."""
+    now = time.monotonic()
+    entry = _GEO_CACHE.get(ip)
+    if entry and now - entry[0] < GEO_CACHE_TTL:
+        _GEO_CACHE.move_to_end(ip)
+        return entry[1]
+
+    task = _GEO_INFLIGHT.get(ip)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_geo(http, ip))
+        _GEO_INFLIGHT[ip] = task
+        task.add_done_callback(lambda _: _GEO_INFLIGHT.pop(ip, None))
+    # Shield so one cancelled caller does not cancel the lookup for the others
+    data = await asyncio.shield(task)
+    # Only cache successful lookups so a transient failure is retried next time
+    if data.get("status") == "success":
+        _GEO_CACHE[ip] = (now, data)
+        _GEO_CACHE.move_to_end(ip)
+        if len(_GEO_CACHE) > GEO_CACHE_MAXSIZE:
+            _GEO_CACHE.popitem(last=False)
+    return data
+
+# Non-public IPv4 ranges as (first, last) integers, plus 100.64.0.0/10 (carrier-grade NAT).
+# Mirrors ipaddress._IPv4Constants._private_networks and _private_networks_exceptions
+# as revised in gh-113171 (CPython 3.11.10+ / 3.12.4+), matching the IPv6 fallback
+_PRIVATE_IPV4_RANGES = tuple(
+    (int(net.network_address), int(net.broadcast_address))
+    for net in map(ipaddress.IPv4Network, (
+        "0.0.0.0/8", "10.0.0.0/8", "100.64.0.0/10", "127.0.0.0/8",
+        "169.254.0.0/16", "172.16.0.0/12", "192.0.0.0/24", "192.0.0.170/31",
+        "192.0.2.0/24", "192.168.0.0/16", "198.18.0.0/15", "198.51.100.0/24",
+        "203.0.113.0/24", "240.0.0.0/4", "255.255.255.255/32",
+    ))
+)
+# Globally reachable addresses inside 192.0.0.0/24 (PCP and TURN anycast)
+_PUBLIC_IPV4_EXCEPTIONS = frozenset(
+    int(ipaddress.IPv4Address(ip)) for ip in ("192.0.0.9", "192.0.0.10")
+)
+
+@functools.lru_cache(maxsize=1024)
 def is_private_ip(ip: str) -> bool:
     """Check if IP address is private."""
     try:
-        return ipaddress.ip_address(ip).is_private
-    except ValueError:
+        n = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        # Not a dotted-quad IPv4 address (e.g. IPv6), use the full parser
+        try:
+            return ipaddress.ip_address(ip).is_private
+        except ValueError:
+            return False
+    if n in _PUBLIC_IPV4_EXCEPTIONS:
         return False
+    return any(low <= n <= high for low, high in _PRIVATE_IPV4_RANGES)
+
+# Server identity does not change while running, so resolve it once at import
+SERVER_HOSTNAME = socket.gethostname()
+try:
+    SERVER_IP = socket.gethostbyname(SERVER_HOSTNAME)
+except OSError:
+    SERVER_IP = "127.0.0.1"
+SERVER_IS_PRIVATE = is_private_ip(SERVER_IP)
+
+# Download payloads are random so they cannot be compressed on the wire
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# All sizes are served from one payload file of this size
+DOWNLOAD_MAX_SIZE_MB = 100
+
+# Keep /dev/urandom open for bulk random reads; fall back to os.urandom without it
+try:
+    _URANDOM_FD = os.open("/dev/urandom", os.O_RDONLY)
+except OSError:
+    _URANDOM_FD = None
+
+def _random_bytes(n: int) -> bytes:
+    """Read up to n random bytes from the pre-opened urandom fd."""
+    if _URANDOM_FD is None:
+        return os.urandom(n)
+    return os.read(_URANDOM_FD, n)
+
+def _write_payload_file(path: str, size_mb: int) -> None:
+    """Write a random payload file of size_mb MiB."""
+    try:
+        with open(path, "wb") as f:
+            remaining = size_mb * DOWNLOAD_CHUNK_SIZE
+            while remaining > 0:
+                chunk = _random_bytes(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                f.write(chunk)
+                remaining -= len(chunk)
+    except BaseException:
+        # Do not leave a partial file behind (e.g. on ENOSPC)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        raise
+
+async def _read_payload(path: str, total_bytes: int):
+    """Yield the first total_bytes of a payload file in 1 MiB chunks."""
+    f = await run_in_threadpool(open, path, "rb")
+    try:
+        remaining = total_bytes
+        while remaining > 0:
+            chunk = await run_in_threadpool(f.read, min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
 
 async def get_network_details(request: Request) -> Dict[str, Any]:
     """Get network details including IPs and location data."""
     try:
-        hostname = socket.gethostname()
-        server_ip = socket.gethostbyname(hostname)
         client_ip = request.client.host
         
         # Get real client IP from headers (for reverse proxy scenarios)
         forwarded_for = request.headers.get("x-forwarded-for")
         if forwarded_for:
-            client_ip = forwarded_for.split(",")[0].strip()
+            client_ip = forwarded_for.split(",", 1)[0].strip()
         
         # Get public IP
-        public_ip = client_ip if not is_private_ip(client_ip) else None
+        client_is_private = is_private_ip(client_ip)
+        public_ip = client_ip if not client_is_private else None
         
         network_info = {
             "server": {
-                "hostname": hostname,
-                "ip": server_ip,
-                "is_private": is_private_ip(server_ip),
+                "hostname": SERVER_HOSTNAME,
+                "ip": SERVER_IP,
+                "is_private": SERVER_IS_PRIVATE,
             },
             "client": {
                 "ip": client_ip,
                 "public_ip": public_ip,
-                "is_private": is_private_ip(client_ip),
+                "is_private": client_is_private,
                 "location": {
                     "country": "Unknown",
                     "city": "Unknown",
@@ -70,7 +213,7 @@ async def get_network_details(request: Request) -> Dict[str, Any]:
         # Get geolocation for client
         if public_ip:
             try:
-                ip_info = requests.get(f"http://ip-api.com/json/{public_ip}", timeout=2).json()
+                ip_info = await geo_lookup(request.app.state.http, public_ip)
                 if ip_info.get('status') == 'success':
                     network_info["client"]["location"] = {
                         "country": ip_info.get("country", "Unknown"),
@@ -86,14 +229,12 @@ async def get_network_details(request: Request) -> Dict[str, Any]:
     except Exception as e:
         return {
             "error": f"Could not fetch network details: {str(e)}",
-            "server": {"hostname": socket.gethostname()},
+            "server": {"hostname": SERVER_HOSTNAME},
             "client": {"ip": request.client.host}
         }
 
-@app.get("/", response_class=HTMLResponse, tags=["Info"])
-async def root():
-    """Serve interactive speed test page."""
-    return """
+# Index page is static, so encode it once and let browsers cache it
+_INDEX_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -190,48 +331,51 @@ async def root():
     </script>
 </body>
 </html>
-    """
+    """.encode("utf-8")
+
+@app.get("/", response_class=HTMLResponse, tags=["Info"])
+async def root():
+    """Serve interactive speed test page."""
+    return HTMLResponse(
+        content=_INDEX_HTML,
+        headers={"Cache-Control": "public, max-age=3600"}
+    )
 
 @app.get("/api/speedtest/ping", tags=["Speed Test"])
-async def test_ping():
+async def test_ping() -> Dict[str, float]:
     """Ping endpoint for latency measurement."""
     return {"timestamp": time.time()}
 
 @app.get("/api/speedtest/download", tags=["Speed Test"])
-async def test_download(size_mb: int = 10):
+async def test_download(request: Request, size_mb: int = Query(10, ge=1, le=DOWNLOAD_MAX_SIZE_MB)):
     """
-    Stream data for download speed test.
+    Stream pre-generated random data for download speed test.
     Client measures time to download.
     """
-    def generate():
-        chunk_size = 256 * 1024
-        total_bytes = size_mb * 1024 * 1024
-        bytes_sent = 0
-        
-        while bytes_sent < total_bytes:
-            chunk = os.urandom(min(chunk_size, total_bytes - bytes_sent))
-            bytes_sent += len(chunk)
-            yield chunk
-
+    total_bytes = size_mb * DOWNLOAD_CHUNK_SIZE
     return StreamingResponse(
-        generate(),
+        _read_payload(request.app.state.payload_path, total_bytes),
         media_type="application/octet-stream",
         headers={
-            "Content-Length": str(size_mb * 1024 * 1024),
+            "Content-Length": str(total_bytes),
             "Cache-Control": "no-cache"
         }
     )
 
+def _upload_size(file: UploadFile) -> int:
+    """Get the size of an uploaded file without reading its contents."""
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, os.SEEK_END)
+    return file.file.tell()
+
 @app.post("/api/speedtest/upload", tags=["Speed Test"])
-async def test_upload(file: UploadFile):
+async def test_upload(file: UploadFile) -> Dict[str, Any]:
     """
     Receive file upload. Returns file size and timestamp for client-side speed calculation.
     Client should measure their own upload time for accurate results.
     """
-    size = 0
-    chunk_size = 256 * 1024
-    while chunk := await file.read(chunk_size):
-        size += len(chunk)
+    size = _upload_size(file)
     
     return {
         "size_bytes": size,
@@ -241,12 +385,18 @@ async def test_upload(file: UploadFile):
     }
 
 @app.get("/api/speedtest/network", tags=["Network"])
-async def network_info(request: Request):
+async def network_info(request: Request) -> Dict[str, Any]:
     """Get client network details."""
     return await get_network_details(request)
 
+SPEED_TEST_INSTRUCTIONS = {
+    "interactive": "Visit / in browser for the most accurate results",
+    "api_download": "GET /api/speedtest/download?size_mb=10 and measure time client-side",
+    "api_upload": "POST /api/speedtest/upload with file and measure time client-side"
+}
+
 @app.get("/api/speedtest/test", tags=["Speed Test"])
-async def speed_test_info(request: Request):
+async def speed_test_info(request: Request) -> Dict[str, Any]:
     """
     Get network info and instructions.
     For actual speed test, visit the root URL (/) for interactive test.
@@ -256,15 +406,18 @@ async def speed_test_info(request: Request):
     return {
         "message": "Speed tests are performed client-side for accuracy",
         "your_network": network,
-        "to_test_speed": {
-            "interactive": "Visit / in browser for the most accurate results",
-            "api_download": "GET /api/speedtest/download?size_mb=10 and measure time client-side",
-            "api_upload": "POST /api/speedtest/upload with file and measure time client-side"
-        },
+        "to_test_speed": SPEED_TEST_INSTRUCTIONS,
         "note": "All speed measurements should be done on the client side for accurate results"
     }
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop" if sys.platform != "win32" else "asyncio",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", "2"))
+    )
\ No newline at end of file
@@ -21,8 +21,9 @@ Write-Host "Download Speed: $($speed.ToString('F2')) Mbps"
 Write-Host "`nTesting Upload Speed..."
 # Create 5MB test file
 $testFile = "testfile.bin"
-$buffer = New-Object byte[] (5 * 1024 * 1024)
-[System.IO.File]::WriteAllBytes($testFile, $buffer)
+$stream = [System.IO.File]::Create($testFile)
+$stream.SetLength(5 * 1024 * 1024)
+$stream.Close()
 curl.exe -X POST -F "file=@$testFile" "$BASE/api/speedtest/upload"
 Remove-Item $testFile
 